@@ -24,5 +24,11 @@ with app.app_context():
     else:
         print("All tables already exist.")
 
+    # Indexes added to the models after the tables were first created;
+    # create_all() skips tables that already exist, so backfill them here too
+    from app.models import CellFeature
+    for index in CellFeature.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -13,3 +13,7 @@ load_dotenv()
 SECRET_KEY = os.environ.get("KEY")
 SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Cellpose inference device ("1" forces CPU even when CUDA is available)
+CELLPOSE_FORCE_CPU = os.environ.get("CELLPOSE_FORCE_CPU") == "1"
+CELLPOSE_DEVICE = os.environ.get("CELLPOSE_DEVICE")  # e.g. "cuda:1"
@@ -23,6 +23,10 @@ class Image(db.Model):
 class CellFeature(db.Model):
     """Cell features extracted from segmentation masks for tracking"""
     __tablename__ = 'cell_features'
+    __table_args__ = (
+        # Lets per-track MIN/MAX(frame_num) and track-ordered exports read off the index
+        db.Index('ix_cellfeature_trackid_frame', 'track_id', 'frame_num'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)
@@ -1,6 +1,8 @@
-from flask import Blueprint, request, jsonify, send_from_directory, send_file, Response, current_app, url_for
+from flask import Blueprint, request, jsonify, send_from_directory, send_file, Response, current_app, url_for, stream_with_context
+import itertools
 import os
 import threading
+import zlib
 from flask_cors import cross_origin
 from app.services.image_services import (
     get_all_images,
@@ -587,18 +589,41 @@ def get_single_track(track_id):
         return jsonify({"error": str(e)}), 500
 
 
+def _gzip_stream(chunks):
+    """
+    Gzip a stream of text chunks on the fly (level 1: cheap, and numeric CSV still shrinks several times).
+    Callers pull the first chunk before wrapping, so setup errors never reach a gzip-encoded response.
+    """
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 @image_bp.route('/tracking/export', methods=['GET'])
 @cross_origin()
 def export_tracking_csv():
-    """Export tracking results to CSV"""
-    try:
-        csv_data = export_tracks_to_csv()
+    """Export tracking results to CSV (gzip-encoded when the client accepts it)"""
+    try:
+        chunks = export_tracks_to_csv()
+        # Pull the first chunk (which runs the query) here, before choosing to gzip,
+        # so setup errors still map to a JSON 500 instead of a truncated 200 or a
+        # response already sent with Content-Encoding: gzip
+        first = next(chunks, '')
+        chunks = itertools.chain([first], chunks)
+        headers = {
+            'Content-Disposition': 'attachment; filename="cell_tracks.csv"',
+            'Vary': 'Accept-Encoding'
+        }
+        if request.accept_encodings['gzip']:
+            chunks = _gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
         return Response(
-            csv_data,
+            stream_with_context(chunks),
             mimetype='text/csv',
-            headers={
-                'Content-Disposition': 'attachment; filename="cell_tracks.csv"'
-            }
+            headers=headers
         )
     except Exception as e:
         print(f"Error exporting tracks: {e}")
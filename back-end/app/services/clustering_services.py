@@ -2,6 +2,8 @@
 Clustering Services - GMM + HMM clustering for cell state classification
 """
 import numpy as np
+from itertools import groupby
+from operator import itemgetter
 from sklearn.mixture import GaussianMixture
 from sklearn.preprocessing import StandardScaler
 from sklearn.manifold import TSNE
@@ -387,18 +389,16 @@ def get_clustering_results():
         CellFeature.gmm_state.isnot(None)
     ).group_by(
         CellFeature.frame_num, CellFeature.gmm_state, CellFeature.hmm_state
-    ).all()
-
-    # Format frame results
-    frames_data = {}
-    for frame_num, gmm_state, hmm_state, count in frame_results:
-        if frame_num not in frames_data:
-            frames_data[frame_num] = []
-        frames_data[frame_num].append({
-            'gmm_state': gmm_state,
-            'hmm_state': hmm_state,
-            'count': count
-        })
+    ).order_by(CellFeature.frame_num).all()
+
+    # Format frame results (rows come ordered by frame, so each frame is one run)
+    frames_data = {
+        frame_num: [
+            {'gmm_state': gmm_state, 'hmm_state': hmm_state, 'count': count}
+            for _, gmm_state, hmm_state, count in rows
+        ]
+        for frame_num, rows in groupby(frame_results, key=itemgetter(0))
+    }
 
     return {
         "gmm_distribution": [{'state': s, 'count': c} for s, c in gmm_states],
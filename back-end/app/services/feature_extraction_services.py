@@ -7,12 +7,42 @@ from PIL import Image
 import csv
 from io import StringIO
 from skimage import measure
+from sqlalchemy import insert
 from app import db, config
 from app.models import Image as ImageModel, CellFeature
 
 MASK_FOLDER = config.MASK_FOLDER
 CONVERTED_FOLDER = config.CONVERTED_FOLDER
 
+# Rows per multi-row INSERT when storing extracted features
+INSERT_CHUNK_SIZE = 5000
+
+
+def bulk_insert_features(rows, chunk_size=INSERT_CHUNK_SIZE):
+    """
+    Insert CellFeature rows in multi-row INSERT batches
+
+    Args:
+        rows: list of dicts mapping CellFeature column names to values
+        chunk_size: Number of rows per INSERT statement
+
+    Returns:
+        list of the new row ids, in the order of rows
+    """
+    if not db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+        # No ordered RETURNING for executemany (e.g. SQLite older than 3.35, as in
+        # the Docker image): let the ORM flush insert the rows and fetch their ids
+        objs = [CellFeature(**row) for row in rows]
+        db.session.add_all(objs)
+        db.session.flush()
+        return [obj.id for obj in objs]
+
+    stmt = insert(CellFeature).returning(CellFeature.id, sort_by_parameter_order=True)
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        ids.extend(db.session.scalars(stmt, rows[start:start + chunk_size]))
+    return ids
+
 
 def extract_features_from_mask(image_id):
     """
@@ -95,7 +125,7 @@ def extract_features_from_mask(image_id):
     CellFeature.query.filter_by(image_id=image_id).delete()
 
     # Extract features using regionprops
-    features_list = []
+    features = []
     regions = measure.regionprops(mask_array, intensity_image=intensity_image)
 
     for idx, region in enumerate(regions):
@@ -136,7 +166,7 @@ def extract_features_from_mask(image_id):
         intensity_ratio_mean_min = mean_intensity / min_intensity if min_intensity > 0 else 1.0
 
         # Create feature record
-        feature = CellFeature(
+        features.append(dict(
             image_id=image_id,
             cell_id=cell_id,
             frame_num=frame_num,
@@ -162,21 +192,26 @@ def extract_features_from_mask(image_id):
             convexity_deficit=convexity_deficit,
             intensity_ratio_max_mean=intensity_ratio_max_mean,
             intensity_ratio_mean_min=intensity_ratio_mean_min
-        )
+        ))
 
-        db.session.add(feature)
-        features_list.append(feature.to_dict())
+    # Insert in batches; the returned dicts carry the database ids and match
+    # CellFeature.to_dict() (columns that weren't set are None)
+    ids = bulk_insert_features(features)
+    columns = [column.name for column in CellFeature.__table__.columns]
+    features_list = [dict(dict.fromkeys(columns), **feature, id=feature_id) for feature, feature_id in zip(features, ids)]
 
     db.session.commit()
     return features_list
 
 
-def extract_features_batch(image_ids=None):
+def extract_features_batch(image_ids=None, return_features=False):
     """
     Extract features for multiple images
 
     Args:
         image_ids: List of image IDs (None = all images with masks)
+        return_features: Also return the extracted feature dicts under "features",
+                         so callers don't have to query them back
 
     Returns:
         dict with batch results
@@ -189,6 +224,7 @@ def extract_features_batch(image_ids=None):
 
     results = []
     errors = []
+    all_features = []
 
     for img_id in image_ids:
         try:
@@ -197,15 +233,20 @@ def extract_features_batch(image_ids=None):
                 "image_id": img_id,
                 "num_cells": len(features)
             })
+            if return_features:
+                all_features.extend(features)
         except Exception as e:
             errors.append({"image_id": img_id, "error": str(e)})
 
-    return {
+    batch_result = {
         "processed": len(results),
         "errors": len(errors),
         "results": results,
         "error_details": errors
     }
+    if return_features:
+        batch_result["features"] = all_features
+    return batch_result
 
 
 def get_features_by_image(image_id):
@@ -94,11 +94,18 @@ def process_and_save_image(image, destination_folder):
         original_mask_filename = converted_filename_base + '_labels.png'
         original_mask_path = os.path.join(dest_dir, original_mask_filename)
 
-        if arr.max() > 255:
+        # Labels above 65535 would wrap in a 16-bit PNG; skip the labels file
+        # so readers fall back to the colored mask
+        if arr.max() > np.iinfo(np.uint16).max:
+            original_mask_img = None
+        elif arr.max() > 255:
             original_mask_img = Image.fromarray(arr.astype(np.uint16), mode='I;16')
         else:
             original_mask_img = Image.fromarray(arr.astype(np.uint8), mode='L')
-        original_mask_img.save(original_mask_path)
+        if original_mask_img is not None:
+            original_mask_img.save(original_mask_path)
+        elif os.path.exists(original_mask_path):
+            os.remove(original_mask_path)
 
         unique_vals = np.unique(arr)
         lut = np.zeros((int(arr.max()) + 1, 3), dtype=np.uint8)
@@ -390,6 +397,11 @@ def update_mask_image(mask_file, image_id):
         img = img.convert("L")
     img.save(output_path, "PNG")
 
+    # Labels saved by segmentation no longer match the edited mask
+    labels_path = os.path.splitext(output_path)[0] + "_labels.png"
+    if os.path.exists(labels_path):
+        os.remove(labels_path)
+
     img_record.mask_filename = mask_filename
     img_record.mask_filepath = output_path
     if img_record.filename and img_record.status == "mask_only":
@@ -2,55 +2,188 @@
 Segmentation Services - Cellpose segmentation for cell images
 """
 import os
+from functools import lru_cache
 import numpy as np
 from PIL import Image
 from flask import url_for
 from app import db, config
 from app.models import Image as ImageModel
 
+# Cellpose (and torch behind it) is imported once at module load; segmentation
+# calls fail with a clear error when it is missing
+try:
+    from cellpose import models as cellpose_models
+except ImportError:
+    cellpose_models = None
+
 MASK_FOLDER = config.MASK_FOLDER
 CONVERTED_FOLDER = config.CONVERTED_FOLDER
 
+# Images larger than this (H*W) are segmented on CPU to avoid exhausting GPU memory
+GPU_MAX_PIXELS = 10_000 ** 2
+
+# Cellpose models are trained at this cell diameter (pixels); images whose longest
+# side exceeds LARGE_IMAGE_SIZE are pre-scaled to it when a diameter is given
+CELLPOSE_DIAMETER = 30.0
+LARGE_IMAGE_SIZE = 2048
+
+# zlib level for mask PNGs written with OpenCV
+PNG_COMPRESSION = 3
+
+# Batch segmentation commits after this many images, so masks already written to
+# disk keep their database records if a later image aborts the batch
+BATCH_COMMIT_EVERY = 10
+
+# Label -> RGB colour table for mask visualisation (label 0 is background);
+# built once from a private generator so the global NumPy RNG is left alone
+MAX_LABEL = 65535
+_COLOR_LUT = np.zeros((MAX_LABEL + 1, 3), dtype=np.uint8)
+_COLOR_LUT[1:] = np.random.default_rng(42).integers(50, 255, size=(MAX_LABEL, 3), dtype=np.uint8)
+
+
+def _should_use_gpu(image_shape):
+    """Use CUDA when available, unless forced off or the image is too large for the GPU"""
+    import torch
+
+    if config.CELLPOSE_FORCE_CPU or not torch.cuda.is_available():
+        return False
+    return image_shape[0] * image_shape[1] <= GPU_MAX_PIXELS
+
+
+@lru_cache(maxsize=4)
+def _get_cellpose_model(use_gpu, model_type=None, device=None):
+    """Load a CellposeModel once per (device, model type); later calls reuse the weights"""
+    if cellpose_models is None:
+        raise ImportError("Cellpose is not installed; run `pip install cellpose` to enable segmentation")
+
+    kwargs = {"gpu": use_gpu}
+    if model_type is not None:
+        kwargs["model_type"] = model_type
+    if use_gpu and device:
+        import torch
+        kwargs["device"] = torch.device(device)
+    return cellpose_models.CellposeModel(**kwargs)
+
+
+def _labels_path(mask_path):
+    """Path of the integer label mask stored next to a colored mask"""
+    return os.path.splitext(mask_path)[0] + '_labels.png'
+
+
+def _rgb_to_gray_u8(rgb):
+    """Integer luma ((77R + 150G + 29B) >> 8) computed in uint16, avoiding a float64 copy of the frame"""
+    out = np.empty(rgb.shape[:2], dtype=np.uint16)
+    tmp = np.empty_like(out)
+    np.multiply(rgb[..., 0], 77, out=out, dtype=np.uint16)
+    np.multiply(rgb[..., 1], 150, out=tmp, dtype=np.uint16)
+    out += tmp
+    np.multiply(rgb[..., 2], 29, out=tmp, dtype=np.uint16)
+    out += tmp
+    out >>= 8
+    return out.astype(np.uint8)
+
 
-def run_cellpose_segmentation(image_id, diameter=None, flow_threshold=0.4, cellprob_threshold=0.0):
+def _load_image_array(image_path, max_size=None):
     """
-    Run Cellpose segmentation on a single image (Cellpose v4.0.1+ API)
+    Decode an image for segmentation without materialising more than needed
+
+    TIFFs are memory-mapped when uncompressed; other formats let PIL decode at
+    reduced resolution (draft mode, JPEG only) when max_size will downscale anyway.
+
+    Returns:
+        tuple (img_array, full_shape) where full_shape is the (height, width) of the file
+    """
+    if image_path.lower().endswith(('.tif', '.tiff')):
+        import tifffile
+        with tifffile.TiffFile(image_path) as tif:
+            axes = tif.pages[0].axes
+        try:
+            img_array = tifffile.memmap(image_path, page=0, mode='r')
+        except ValueError:
+            # Compressed or non-contiguous TIFF
+            img_array = tifffile.imread(image_path, key=0)
+        if img_array.ndim == 3 and axes.startswith('S'):
+            # Planar (channels-first) page: move samples last like every other format
+            img_array = np.moveaxis(img_array, 0, -1)
+        return img_array, img_array.shape[:2]
+
+    img = Image.open(image_path)
+    full_shape = (img.height, img.width)
+    if max_size and max(full_shape) > max_size:
+        scale = max_size / max(full_shape)
+        img.draft(img.mode, (int(img.width * scale), int(img.height * scale)))
+    return np.array(img), full_shape
+
+
+def _image_path_candidates(img_record):
+    """Possible source files for an image, in order of preference (edited, original, converted)"""
+    candidates = [img_record.edited_filepath, img_record.filepath]
+    if img_record.filename:
+        converted_name = os.path.splitext(img_record.filename)[0] + '.png'
+        candidates.append(os.path.join(CONVERTED_FOLDER, converted_name))
+    return [path for path in candidates if path]
+
+
+def _existing_files(paths):
+    """Normalised paths of the files that exist, listing each parent directory only once"""
+    existing = set()
+    for folder in {os.path.dirname(os.path.normpath(path)) for path in paths}:
+        try:
+            with os.scandir(folder) as entries:
+                existing.update(os.path.normpath(entry.path) for entry in entries if entry.is_file())
+        except OSError:
+            continue
+    return existing
+
+
+def run_cellpose_segmentation(image_id, model_type=None, diameter=None, flow_threshold=0.4, cellprob_threshold=0.0,
+                              max_size=None):
+    """
+    Run Cellpose segmentation on a single image
 
     Args:
         image_id: Database ID of the image
+        model_type: Pre-v4 Cellpose model name (e.g. 'cyto3'); None uses the v4.0.1+ default model
         diameter: Expected cell diameter (None for auto-detection)
         flow_threshold: Flow error threshold
         cellprob_threshold: Cell probability threshold
+        max_size: Downscale the longest side to this many pixels before inference
+                  (masks are mapped back to full resolution before saving)
 
     Returns:
         dict with segmentation results
     """
-    from cellpose import models
-
     img_record = ImageModel.query.get(image_id)
     if not img_record:
         raise ValueError(f"Image with id {image_id} not found")
 
+    return _run_cellpose_segmentation_prefetched(
+        img_record, model_type=model_type, diameter=diameter, flow_threshold=flow_threshold,
+        cellprob_threshold=cellprob_threshold, max_size=max_size
+    )
+
+
+def _run_cellpose_segmentation_prefetched(img_record, model_type=None, diameter=None, flow_threshold=0.4,
+                                          cellprob_threshold=0.0, max_size=None, exists=os.path.exists, commit=True):
+    """
+    Segment an already-loaded image record (see run_cellpose_segmentation)
+
+    Args:
+        exists: Callable used to check candidate image paths
+        commit: Commit the mask path update (batch callers commit once at the end)
+    """
+    import cv2
+
+    image_id = img_record.id
     session_id = img_record.session_id
 
-    # Get the image path (use edited if available, else converted)
-    if img_record.edited_filepath and os.path.exists(img_record.edited_filepath):
-        image_path = img_record.edited_filepath
-    elif img_record.filepath and os.path.exists(img_record.filepath):
-        image_path = img_record.filepath
-    else:
-        # Try converted folder
-        if img_record.filename:
-            converted_name = os.path.splitext(img_record.filename)[0] + '.png'
-            image_path = os.path.join(CONVERTED_FOLDER, converted_name)
-            if not os.path.exists(image_path):
-                raise ValueError(f"No image file found for image id {image_id}")
-        else:
-            raise ValueError(f"No image file found for image id {image_id}")
+    # Get the image path (use edited if available, else original, else converted)
+    image_path = next((path for path in _image_path_candidates(img_record) if exists(path)), None)
+    if image_path is None:
+        raise ValueError(f"No image file found for image id {image_id}")
 
     # Load image
-    img = Image.open(image_path)
-    img_array = np.array(img)
+    img_array, full_shape = _load_image_array(image_path, max_size)
 
     # Save mask with original image extension (TIF, PNG, etc.)
     # Route will convert TIF to PNG on-the-fly for browser display
@@ -61,16 +194,39 @@ def run_cellpose_segmentation(image_id, diameter=None, flow_threshold=0.4, cellp
 
     # Convert to grayscale if needed
     if len(img_array.shape) == 3:
-        img_array = np.mean(img_array, axis=2)
-
-    # Run Cellpose (v4.0.1+ API - no model_type, no channels)
-    model = models.CellposeModel(gpu=False)
-    masks, flows, styles = model.eval(
-        img_array,
-        diameter=diameter,
-        flow_threshold=flow_threshold,
-        cellprob_threshold=cellprob_threshold
-    )
+        if img_array.dtype == np.uint8 and img_array.shape[2] >= 3:
+            img_array = _rgb_to_gray_u8(img_array)
+        else:
+            img_array = np.mean(img_array, axis=2)
+
+    # Downscale large inputs once here rather than inside Cellpose; cell diameter
+    # shrinks with the image (PIL draft may already have decoded at reduced size)
+    scale = img_array.shape[0] / full_shape[0]
+    resize = 1.0
+    if max_size and max(img_array.shape) > max_size:
+        resize = max_size / max(img_array.shape)
+    if diameter and max(full_shape) > LARGE_IMAGE_SIZE:
+        resize = min(resize, CELLPOSE_DIAMETER / (diameter * scale))
+    if resize < 1.0:
+        img_array = cv2.resize(img_array, None, fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+        scale = img_array.shape[0] / full_shape[0]
+
+    # Run Cellpose (v4.0.1+ API takes no model_type and no channels; older
+    # named models expect single-channel grayscale as channels=[0, 0])
+    use_gpu = _should_use_gpu(img_array.shape)
+    model = _get_cellpose_model(use_gpu, model_type=model_type, device=config.CELLPOSE_DEVICE)
+    eval_kwargs = {
+        "diameter": diameter * scale if diameter else diameter,
+        "flow_threshold": flow_threshold,
+        "cellprob_threshold": cellprob_threshold,
+    }
+    if model_type is not None:
+        eval_kwargs["channels"] = [0, 0]
+    masks, flows, styles = model.eval(img_array, **eval_kwargs)
+
+    # Labels must line up with the original image
+    if masks.shape != full_shape:
+        masks = cv2.resize(masks, (full_shape[1], full_shape[0]), interpolation=cv2.INTER_NEAREST)
 
     # Save mask to session folder with original format
     stem = os.path.splitext(img_record.filename)[0] if img_record.filename else f"image_{image_id}"
@@ -86,8 +242,21 @@ def run_cellpose_segmentation(image_id, diameter=None, flow_threshold=0.4, cellp
     print(f"[DEBUG] Mask filename: {mask_filename}")
 
     # Convert mask to colored visualization and save
+    # (OpenCV's encoder is faster than PIL's; PNG level 3 trades a little size for speed)
     colored_mask = create_colored_mask(masks)
-    Image.fromarray(colored_mask).save(mask_path)
+    png_params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    cv2.imwrite(mask_path, cv2.cvtColor(colored_mask, cv2.COLOR_RGB2BGR),
+                png_params if mask_ext == '.png' else [])
+
+    # Keep the integer labels too, so features and contours don't have to
+    # recover cells from colors. A 16-bit PNG would wrap labels above 65535,
+    # so such masks get no labels file and readers use the colored mask
+    labels_path = _labels_path(mask_path)
+    if masks.size and masks.max() > np.iinfo(np.uint16).max:
+        if os.path.exists(labels_path):
+            os.remove(labels_path)
+    else:
+        cv2.imwrite(labels_path, masks.astype(np.uint16), png_params)
 
     # Verify file was saved
     if os.path.exists(mask_path):
@@ -98,10 +267,16 @@ def run_cellpose_segmentation(image_id, diameter=None, flow_threshold=0.4, cellp
     # Update database
     img_record.mask_filename = mask_filename
     img_record.mask_filepath = mask_path
-    db.session.commit()
-
-    # Count cells
-    num_cells = len(np.unique(masks)) - 1  # Exclude background (0)
+    if commit:
+        db.session.commit()
+
+    # Count cells (Cellpose labels are 1..N; resizing back may drop tiny cells)
+    if masks.size == 0:
+        num_cells = 0
+    elif scale == 1.0:
+        num_cells = int(masks.max())
+    else:
+        num_cells = int(np.count_nonzero(np.bincount(masks.ravel())[1:]))
 
     # Use correct route with session_id
     if session_id:
@@ -120,34 +295,58 @@ def run_cellpose_segmentation(image_id, diameter=None, flow_threshold=0.4, cellp
     }
 
 
-def run_batch_segmentation(image_ids=None, diameter=None):
+def run_batch_segmentation(image_ids=None, model_type=None, diameter=None, max_size=None):
     """
-    Run Cellpose segmentation on multiple images (Cellpose v4.0.1+ API)
+    Run Cellpose segmentation on multiple images
 
     Args:
         image_ids: List of image IDs (None = all images without masks)
+        model_type: Pre-v4 Cellpose model name (None = v4.0.1+ default model)
         diameter: Expected cell diameter
+        max_size: Longest side (pixels) to downscale each image to before inference
 
     Returns:
         dict with batch results
     """
     if image_ids is None:
         # Get all images without masks
-        images = ImageModel.query.filter(
+        records = ImageModel.query.filter(
             ImageModel.filename.isnot(None),
             ImageModel.mask_filename.is_(None)
         ).all()
-        image_ids = [img.id for img in images]
+        image_ids = [img.id for img in records]
+    else:
+        records = ImageModel.query.filter(ImageModel.id.in_(image_ids)).all()
+    by_id = {img.id: img for img in records}
+
+    # One directory listing per folder instead of stat() calls per image
+    existing = _existing_files(path for img in records for path in _image_path_candidates(img))
+
+    def exists(path):
+        return os.path.normpath(path) in existing
 
     results = []
     errors = []
 
     for img_id in image_ids:
         try:
-            result = run_cellpose_segmentation(img_id, diameter=diameter)
+            img_record = by_id.get(img_id)
+            if not img_record:
+                raise ValueError(f"Image with id {img_id} not found")
+            result = _run_cellpose_segmentation_prefetched(
+                img_record, model_type=model_type, diameter=diameter, max_size=max_size, exists=exists,
+                commit=False
+            )
             results.append(result)
         except Exception as e:
             errors.append({"image_id": img_id, "error": str(e)})
+            continue
+        # Commit in groups rather than per image, so the prefetched records are
+        # not expired and reloaded after every image
+        if len(results) % BATCH_COMMIT_EVERY == 0:
+            db.session.commit()
+
+    db.session.commit()
 
     return {
         "processed": len(results),
@@ -167,18 +366,7 @@ def create_colored_mask(masks):
     Returns:
         RGB numpy array with colored cells
     """
-    np.random.seed(42)
-
-    unique_labels = np.unique(masks)
-    colored = np.zeros((*masks.shape, 3), dtype=np.uint8)
-
-    for label in unique_labels:
-        if label == 0:  # Background
-            continue
-        color = np.random.randint(50, 255, 3)
-        colored[masks == label] = color
-
-    return colored
+    return _COLOR_LUT[np.clip(masks, 0, MAX_LABEL)]
 
 
 def get_cell_contours(image_id):
@@ -192,6 +380,7 @@ def get_cell_contours(image_id):
         List of cell contours with cell_id and polygon points
     """
     import cv2
+    from scipy import ndimage
     from app.models import CellFeature
 
     img_record = ImageModel.query.get(image_id)
@@ -201,9 +390,16 @@ def get_cell_contours(image_id):
     if not os.path.exists(img_record.mask_filepath):
         return []
 
-    # Load the colored mask and convert to label mask
-    mask_img = Image.open(img_record.mask_filepath)
-    mask_array = np.array(mask_img)
+    # Prefer the integer label mask; fall back to the colored mask
+    labels_path = _labels_path(img_record.mask_filepath)
+    if os.path.exists(labels_path):
+        labels = np.array(Image.open(labels_path))
+        mask_array = labels
+        # Bounding box of every label in one pass, so each cell only touches its own slice
+        label_slices = ndimage.find_objects(labels)
+    else:
+        labels = None
+        mask_array = np.array(Image.open(img_record.mask_filepath))
 
     # If colored (RGB), we need to get cell features to map
     # Load original grayscale mask if available, or use cell features
@@ -214,23 +410,33 @@ def get_cell_contours(image_id):
     contours_data = []
 
     for feature in features:
-        # Create a mask for this specific cell based on bounding box and centroid
         cell_id = feature.cell_id
-        min_row = int(feature.min_row_bb) if feature.min_row_bb else 0
-        max_row = int(feature.max_row_bb) if feature.max_row_bb else mask_array.shape[0]
-        min_col = int(feature.min_col_bb) if feature.min_col_bb else 0
-        max_col = int(feature.max_col_bb) if feature.max_col_bb else mask_array.shape[1]
-
-        # Extract the region
-        if len(mask_array.shape) == 3:
-            region = mask_array[min_row:max_row, min_col:max_col]
-            # Convert to grayscale for contour detection
-            region_gray = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
-        else:
-            region_gray = mask_array[min_row:max_row, min_col:max_col]
 
-        # Threshold to get binary mask
-        _, binary = cv2.threshold(region_gray, 10, 255, cv2.THRESH_BINARY)
+        if labels is not None:
+            if not 0 < cell_id <= len(label_slices) or label_slices[cell_id - 1] is None:
+                continue
+            rows, cols = label_slices[cell_id - 1]
+            min_row, min_col = rows.start, cols.start
+
+            # Exact pixels of this cell
+            binary = (labels[rows, cols] == cell_id).astype(np.uint8) * 255
+        else:
+            # Create a mask for this specific cell based on bounding box and centroid
+            min_row = int(feature.min_row_bb) if feature.min_row_bb else 0
+            max_row = int(feature.max_row_bb) if feature.max_row_bb else mask_array.shape[0]
+            min_col = int(feature.min_col_bb) if feature.min_col_bb else 0
+            max_col = int(feature.max_col_bb) if feature.max_col_bb else mask_array.shape[1]
+
+            # Extract the region
+            if len(mask_array.shape) == 3:
+                region = mask_array[min_row:max_row, min_col:max_col]
+                # Convert to grayscale for contour detection
+                region_gray = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
+            else:
+                region_gray = mask_array[min_row:max_row, min_col:max_col]
+
+            # Threshold to get binary mask
+            _, binary = cv2.threshold(region_gray, 10, 255, cv2.THRESH_BINARY)
 
         # Find contours
         contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -2,17 +2,32 @@
 Tracking Services - Cell tracking across frames
 Supports both simple nearest-neighbor tracking and GNN-based tracking (cell-tracker-gnn)
 """
+import gc
 import os
+import re
 import sys
 import numpy as np
-import csv
+import json
 import tempfile
+import time
 import shutil
-from io import StringIO
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, repeat
+from operator import attrgetter, itemgetter
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
+from sqlalchemy import select, update
 from app import db, config
 from app.models import Image as ImageModel, CellFeature
 
+# Cost matrices with fewer allowed (finite) pairs than this fraction are solved
+# as a sparse bipartite graph instead of densely
+SPARSE_ASSIGNMENT_DENSITY = 0.2
+
 # GNN tracking configuration
 GNN_TRACKER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'cell_tracker_gnn')
 GNN_MODEL_PATH = os.path.join(GNN_TRACKER_PATH, 'models')  # Where pretrained models should be stored
@@ -49,6 +64,46 @@ PRETRAINED_DATASETS = {
     },
 }
 
+# Sequence suffixes ("-01", "-02") stripped from dataset names to find their model set
+_SEQUENCE_SUFFIX = re.compile(r'(-\d+)+$')
+
+# Threads used to stage images and masks for the GNN pipeline
+STAGING_WORKERS = 8
+
+# Threads matching frame transitions in parallel during nearest-neighbour tracking
+TRACKING_WORKERS = min(8, os.cpu_count() or 1)
+
+# Approximate size (characters) of each chunk yielded by the CSV export stream
+CSV_CHUNK_SIZE = 8 * 1024
+
+# Columns of the GNN's all_data_df.csv that drive the track assignment (seg_label,
+# or id when it is missing, as the cell label); the feature columns are never parsed
+GNN_DF_COLUMNS = frozenset({'frame_num', 'seg_label', 'id'})
+
+# Pretrained model files found on disk, remembered for this many seconds so dataset
+# lookups don't stat every model path on each request; missing files are never
+# cached, so models installed while the server runs are picked up right away
+MODEL_EXISTS_TTL = 60.0
+_exists_cache = {}
+
+
+def _exists_cached(path):
+    """os.path.exists with positive results cached for MODEL_EXISTS_TTL seconds"""
+    now = time.monotonic()
+    found_at = _exists_cache.get(path)
+    if found_at is not None and now - found_at < MODEL_EXISTS_TTL:
+        return True
+    if not os.path.exists(path):
+        _exists_cache.pop(path, None)
+        return False
+    _exists_cache[path] = now
+    return True
+
+
+def clear_caches():
+    """Forget cached model file checks (e.g. right after pretrained models are removed)"""
+    _exists_cache.clear()
+
 
 def get_pretrained_models_for_dataset(dataset_name):
     """
@@ -64,18 +119,23 @@ def get_pretrained_models_for_dataset(dataset_name):
     if not dataset_name:
         return None, None
 
-    # Try exact match first
-    if dataset_name in PRETRAINED_DATASETS:
-        models = PRETRAINED_DATASETS[dataset_name]
-        if os.path.exists(models["metric_model"]) and os.path.exists(models["tracking_model"]):
-            print(f"Found exact match pretrained models for: {dataset_name}")
+    # Try exact match first, then the name without its sequence number (-01, -02)
+    key = dataset_name if dataset_name in PRETRAINED_DATASETS else _SEQUENCE_SUFFIX.sub('', dataset_name)
+    if key in PRETRAINED_DATASETS:
+        models = PRETRAINED_DATASETS[key]
+        if _exists_cached(models["metric_model"]) and _exists_cached(models["tracking_model"]):
+            if key == dataset_name:
+                print(f"Found exact match pretrained models for: {dataset_name}")
+            else:
+                print(f"Found partial match pretrained models: {key} for dataset: {dataset_name}")
             return models["metric_model"], models["tracking_model"]
 
-    # Try partial match (remove sequence number like -01, -02)
+    # Names with other decorations (paths, prefixes), or whose exact match has no
+    # model files, fall back to a containment scan
     for key in PRETRAINED_DATASETS:
         if dataset_name.startswith(key) or key in dataset_name:
             models = PRETRAINED_DATASETS[key]
-            if os.path.exists(models["metric_model"]) and os.path.exists(models["tracking_model"]):
+            if _exists_cached(models["metric_model"]) and _exists_cached(models["tracking_model"]):
                 print(f"Found partial match pretrained models: {key} for dataset: {dataset_name}")
                 return models["metric_model"], models["tracking_model"]
 
@@ -94,9 +154,9 @@ def get_available_pretrained_datasets():
     for name, paths in PRETRAINED_DATASETS.items():
         result.append({
             "name": name,
-            "metric_model_exists": os.path.exists(paths["metric_model"]),
-            "tracking_model_exists": os.path.exists(paths["tracking_model"]),
-            "ready": os.path.exists(paths["metric_model"]) and os.path.exists(paths["tracking_model"])
+            "metric_model_exists": _exists_cached(paths["metric_model"]),
+            "tracking_model_exists": _exists_cached(paths["tracking_model"]),
+            "ready": _exists_cached(paths["metric_model"]) and _exists_cached(paths["tracking_model"])
         })
     return result
 
@@ -133,6 +193,287 @@ def check_gnn_availability():
 check_gnn_availability()
 
 
+def _pairs_within(curr_xy, prev_xy, max_distance):
+    """
+    Candidate links between two frames: every (curr, prev) pair within max_distance.
+
+    Both frames go into KD-trees and only neighbouring pairs are visited, so the
+    work grows with the number of candidates rather than n_curr * n_prev.
+
+    Returns:
+        tuple (rows, cols, dists) of curr indices, prev indices and float32 distances
+    """
+    pairs = cKDTree(curr_xy).sparse_distance_matrix(cKDTree(prev_xy), max_distance, output_type='ndarray')
+    return pairs['i'].astype(np.intp), pairs['j'].astype(np.intp), pairs['v'].astype(np.float32)
+
+
+def _solve_assignment(rows, cols, dists, shape):
+    """
+    Minimum-cost assignment where only the listed (row, col) pairs may be linked.
+
+    linear_sum_assignment rejects matrices without a complete finite assignment, so
+    forbidden pairs get a finite sentinel larger than any all-finite assignment total;
+    the solver then links as many cells as possible and sentinel matches are dropped.
+
+    When max_distance leaves only a few allowed pairs, the matching is solved on the
+    sparse graph of those pairs instead. A full matching there would need every cell
+    on the smaller side to be linkable, so each cell also gets a dummy partner at
+    the same sentinel cost (cells entering or leaving the field of view just match
+    their dummy), and dummies of linked cells pair up with each other for free.
+
+    Args:
+        rows, cols, dists: Allowed pairs and their costs (see _pairs_within)
+        shape: (n_curr, n_prev)
+
+    Returns:
+        tuple (row_ind, col_ind) of the linked pairs only
+    """
+    unmatched_cost = (float(dists.max(initial=0.0)) + 1.0) * min(shape)
+
+    if len(rows) < SPARSE_ASSIGNMENT_DENSITY * shape[0] * shape[1]:
+        # Square graph over curr + dummy-prev rows and prev + dummy-curr columns:
+        # real pairs, cell -> own dummy, and dummy -> dummy mirroring each real pair
+        n_curr, n_prev = shape
+        size = n_curr + n_prev
+        curr = np.arange(n_curr)
+        prev = np.arange(n_prev)
+        graph_rows = np.concatenate((rows, curr, n_curr + prev, n_curr + cols))
+        graph_cols = np.concatenate((cols, n_prev + curr, prev, n_prev + rows))
+        # +1 keeps zero costs from being dropped as implicit zeros; a constant offset
+        # doesn't change which full matching is cheapest. float64 keeps the small
+        # distances exact next to the large dummy cost
+        weights = np.concatenate((
+            dists.astype(np.float64), np.full(size, unmatched_cost), np.zeros(len(rows))
+        )) + 1.0
+        graph = csr_matrix((weights, (graph_rows, graph_cols)), shape=(size, size))
+        row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+        keep = (row_ind < n_curr) & (col_ind < n_prev)
+        return row_ind[keep], col_ind[keep]
+
+    # Allowed costs are at least 1 below the sentinel, so the cost matrix itself tells
+    # which matches were real links (no separate mask of allowed pairs)
+    cost_matrix = np.full(shape, unmatched_cost, dtype=np.float32)
+    cost_matrix[rows, cols] = dists
+    row_ind, col_ind = linear_sum_assignment(cost_matrix)
+    keep = cost_matrix[row_ind, col_ind] < np.float32(unmatched_cost)
+    return row_ind[keep], col_ind[keep]
+
+
+def _new_tracks(track_ids, rows, next_track_id):
+    """
+    Start a new track for each of the given feature rows.
+
+    Args:
+        track_ids: Per-feature track ID array, updated in place
+        rows: Indices of the features that start new tracks
+        next_track_id: First unused track ID
+
+    Returns:
+        The next unused track ID
+    """
+    track_ids[rows] = np.arange(next_track_id, next_track_id + len(rows))
+    return next_track_id + len(rows)
+
+
+def _compute_motion(curr_xy, prev_xy, prev_deltas):
+    """
+    Motion features for linked cells, computed for all pairs of a frame transition at once.
+
+    Args:
+        curr_xy: (N, 2) centroids (row, col) of the current cells
+        prev_xy: (N, 2) centroids of the previous cells they are linked to
+        prev_deltas: (N, 2) (delta_x, delta_y) of the previous cells, NaN where unknown
+
+    Returns:
+        delta_x, delta_y, displacement and turning arrays; turning is wrapped to
+        [-pi, pi) and NaN where the previous cell had no motion
+    """
+    delta_x = curr_xy[:, 1] - prev_xy[:, 1]
+    delta_y = curr_xy[:, 0] - prev_xy[:, 0]
+    displacement = np.hypot(delta_x, delta_y)
+
+    # Stored motion is NaN where unknown, so that is where turning is undefined;
+    # the angles are only computed for the pairs that have it
+    turning = np.full(len(delta_x), np.nan)
+    has_motion = np.flatnonzero(~np.isnan(prev_deltas).any(axis=1))
+    turning[has_motion] = (np.arctan2(delta_y[has_motion], delta_x[has_motion])
+                           - np.arctan2(prev_deltas[has_motion, 1], prev_deltas[has_motion, 0]))
+    turning += np.pi
+    np.remainder(turning, 2 * np.pi, out=turning)
+    turning -= np.pi
+    return delta_x, delta_y, displacement, turning
+
+
+def _track_updates(ids, track_ids, linked, deltas, displacement, turning):
+    """
+    bulk_update_mappings rows from per-feature tracking arrays.
+
+    Every feature gets its track ID (unless track_ids is None, when they have been
+    set in SQL already); motion columns are only written for features linked to a
+    previous cell (stored motion of unlinked cells is left as is), and turning only
+    where it is defined (not NaN).
+
+    Rows are returned grouped by the columns they set: bulk_update_mappings starts
+    a new executemany batch whenever consecutive rows differ, so interleaved rows
+    would cost a round trip per run of identical key sets.
+    """
+    unlinked, moved, turned = [], [], []
+    track_ids = repeat(None) if track_ids is None else track_ids.tolist()
+    for feature_id, track_id, is_linked, (delta_x, delta_y), disp, turn in zip(
+            ids.tolist(), track_ids, linked.tolist(), deltas.tolist(),
+            displacement.tolist(), turning.tolist()):
+        mapping = {"id": feature_id} if track_id is None else {"id": feature_id, "track_id": track_id}
+        if not is_linked:
+            if track_id is not None:
+                unlinked.append(mapping)
+            continue
+        mapping.update(delta_x=delta_x, delta_y=delta_y, displacement=disp, speed=disp)
+        if turn != turn:
+            moved.append(mapping)
+        else:
+            mapping["turning"] = turn
+            turned.append(mapping)
+    return unlinked + moved + turned
+
+
+def _save_tracks(ids, track_ids, linked, deltas, displacement, turning):
+    """Write tracking results back in bulk (see _track_updates) and commit"""
+    updates = _track_updates(ids, track_ids, linked, deltas, displacement, turning)
+    db.session.bulk_update_mappings(CellFeature, updates)
+    db.session.commit()
+
+
+def _frame_slices(frame_col):
+    """
+    Row slice of each frame in a frame-sorted column.
+
+    Returns:
+        tuple (frame_slices, frame_nums) in frame order
+    """
+    starts = np.flatnonzero(np.r_[True, np.diff(frame_col) != 0])
+    stops = np.r_[starts[1:], len(frame_col)]
+    frame_slices = [slice(start, stop) for start, stop in zip(starts.tolist(), stops.tolist())]
+    return frame_slices, frame_col[starts].tolist()
+
+
+def _link_tracks(frame_slices, xy, deltas, links):
+    """
+    Track IDs and motion features from the links picked for each frame transition.
+
+    The nearest-neighbour and GNN trackers only differ in how they pick links;
+    applying them is the same: a linked cell continues the previous cell's track,
+    motion is computed where both cells have a centroid (turning is NaN where the
+    previous cell had no motion, from this run or stored), and every other cell
+    starts a new track.
+
+    Args:
+        frame_slices: Row slice of each frame, in frame order (see _frame_slices)
+        xy: (N, 2) centroids (row, col), NaN where missing
+        deltas: (N, 2) stored (delta_x, delta_y), NaN where unknown; overwritten
+                for linked rows
+        links: (curr_rows, prev_rows) for each transition in frame order; consumed
+               lazily, so it may be a generator or executor.map
+
+    Returns:
+        tuple (track_ids, linked, displacement, turning, num_tracks)
+    """
+    num_features = len(xy)
+    track_ids = np.zeros(num_features, dtype=np.int64)
+    assigned = np.zeros(num_features, dtype=bool)
+    linked = np.zeros(num_features, dtype=bool)
+    displacement = np.full(num_features, np.nan)
+    turning = np.full(num_features, np.nan)
+    has_centroid = ~np.isnan(xy).any(axis=1)
+
+    # First frame - assign new track IDs
+    first = frame_slices[0]
+    next_track_id = _new_tracks(track_ids, np.arange(first.start, first.stop), 1)
+
+    for curr_slice, (ci, pi) in zip(frame_slices[1:], links):
+        # Link to existing tracks and compute motion features for all pairs at once
+        track_ids[ci] = track_ids[pi]
+        assigned[ci] = True
+        both = has_centroid[ci] & has_centroid[pi]
+        ci = ci[both]
+        pi = pi[both]
+        linked[ci] = True
+        deltas[ci, 0], deltas[ci, 1], displacement[ci], turning[ci] = _compute_motion(xy[ci], xy[pi], deltas[pi])
+
+        # Assign new track IDs to unassigned cells
+        unassigned = np.flatnonzero(~assigned[curr_slice]) + curr_slice.start
+        next_track_id = _new_tracks(track_ids, unassigned, next_track_id)
+
+    # IDs were handed out consecutively from 1
+    return track_ids, linked, displacement, turning, next_track_id - 1
+
+
+def _value_counts(values):
+    """
+    Occurrence count of each distinct value in an integer array.
+
+    Mask labels are small and dense, so counting them is a single bincount pass;
+    sparse value ranges fall back to np.unique, which sorts.
+    """
+    low = values.min()
+    span = int(values.max() - low) + 1
+    if span <= 2 * len(values) + 65536:
+        counts = np.bincount(values - low, minlength=span)
+        return counts[counts > 0]
+    return np.unique(values, return_counts=True)[1]
+
+
+def _feature_arrays(features):
+    """
+    Per-column arrays for (non-empty) CellFeature select() rows.
+
+    Each column is converted in one pass: integer columns become int64 arrays, the
+    others float64 with NULLs as NaN.
+
+    Returns:
+        dict mapping column name to array
+    """
+    columns = CellFeature.__table__.c
+    return {
+        name: np.array(values, dtype=np.int64 if columns[name].type.python_type is int else np.float64)
+        for name, values in zip(features[0]._fields, zip(*features))
+    }
+
+
+def _load_features_or_extract(stmt, extracted=None):
+    """
+    Rows for a CellFeature select, auto-extracting features from the masks when there are none.
+
+    Right after extraction the rows are built from the extracted feature dicts
+    (sorted by frame_num, cell_id like the tracking queries) instead of reading
+    the freshly written table back.
+
+    Args:
+        stmt: select() of CellFeature columns
+        extracted: Feature dicts from an extraction the caller has just run; when
+                   given, the rows are built from them without querying
+
+    Returns:
+        list of rows with the selected columns as attributes (empty if nothing could be extracted)
+    """
+    if extracted is None:
+        features = db.session.execute(stmt).all()
+        print(f"Found {len(features)} existing features in database", flush=True)
+        if features:
+            return features
+
+        print("No features found, auto-extracting features from masks...", flush=True)
+        from app.services.feature_extraction_services import extract_features_batch
+        extract_result = extract_features_batch(return_features=True)
+        extracted = extract_result.pop("features")
+        print(f"Auto-extract completed: {extract_result}", flush=True)
+
+    row_type = namedtuple("FeatureRow", stmt.selected_columns.keys())
+    extracted.sort(key=itemgetter("frame_num", "cell_id"))
+    features = [row_type(*(feature[name] for name in row_type._fields)) for feature in extracted]
+    print(f"After extraction: {len(features)} features", flush=True)
+    return features
+
+
 def run_tracking(max_distance=100.0):
     """
     Run simple nearest-neighbor cell tracking based on centroid distance
@@ -147,33 +488,26 @@ def run_tracking(max_distance=100.0):
     print("TRACKING SERVICE: Starting tracking process...", flush=True)
     print(f"Max distance threshold: {max_distance}", flush=True)
 
-    # Get all features ordered by frame
-    features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
-    print(f"Found {len(features)} existing features in database")
-
+    # Get the columns needed for tracking, ordered by frame (plain rows, no ORM objects)
+    stmt = select(
+        CellFeature.id, CellFeature.frame_num, CellFeature.centroid_row, CellFeature.centroid_col,
+        CellFeature.delta_x, CellFeature.delta_y
+    ).order_by(CellFeature.frame_num, CellFeature.cell_id)
     # Auto extract features if not available
+    features = _load_features_or_extract(stmt)
     if not features:
-        print("No features found, auto-extracting features from masks...")
-        from app.services.feature_extraction_services import extract_features_batch
-        extract_result = extract_features_batch()
-        print(f"Auto-extract completed: {extract_result}")
-
-        # Re-query features after extraction
-        features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
-        print(f"After extraction: {len(features)} features")
-
-        if not features:
-            print("ERROR: No features found after extraction!")
-            return {"error": "No features found. Make sure masks are available."}
-
-    # Group by frame
-    frames = {}
-    for f in features:
-        if f.frame_num not in frames:
-            frames[f.frame_num] = []
-        frames[f.frame_num].append(f)
-
-    frame_nums = sorted(frames.keys())
+        print("ERROR: No features found after extraction!")
+        return {"error": "No features found. Make sure masks are available."}
+
+    # Pull the columns into arrays once (NULLs become NaN); rows are sorted by
+    # frame, so each frame is a contiguous slice
+    columns = _feature_arrays(features)
+    ids = columns['id']
+    frame_col = columns['frame_num']
+    xy = np.column_stack((columns['centroid_row'], columns['centroid_col']))
+    deltas = np.column_stack((columns['delta_x'], columns['delta_y']))
+
+    frame_slices, frame_nums = _frame_slices(frame_col)
     print(f"Grouped features into {len(frame_nums)} frames")
     print(f"Frame range: {frame_nums[0]} to {frame_nums[-1]}" if frame_nums else "No frames")
 
@@ -181,75 +515,37 @@ def run_tracking(max_distance=100.0):
         print("Need at least 2 frames for tracking")
         return {"message": "Need at least 2 frames for tracking", "tracks": 0}
 
-    # Initialize tracking
-    next_track_id = 1
-    track_mapping = {}  # cell_id -> track_id for current frame
+    # Cells without a centroid can't be linked; they start new tracks
+    has_centroid = ~np.isnan(xy).any(axis=1)
 
-    # First frame - assign new track IDs
-    for cell in frames[frame_nums[0]]:
-        cell.track_id = next_track_id
-        track_mapping[cell.id] = next_track_id
-        next_track_id += 1
-
-    # Track through subsequent frames
-    for i in range(1, len(frame_nums)):
-        prev_frame = frame_nums[i - 1]
-        curr_frame = frame_nums[i]
-
-        prev_cells = frames[prev_frame]
-        curr_cells = frames[curr_frame]
-
-        # Build cost matrix based on distance
-        cost_matrix = np.full((len(curr_cells), len(prev_cells)), np.inf)
-
-        for ci, curr_cell in enumerate(curr_cells):
-            for pi, prev_cell in enumerate(prev_cells):
-                if curr_cell.centroid_row is None or prev_cell.centroid_row is None:
-                    continue
-                dist = np.sqrt(
-                    (curr_cell.centroid_row - prev_cell.centroid_row) ** 2 +
-                    (curr_cell.centroid_col - prev_cell.centroid_col) ** 2
-                )
-                if dist <= max_distance:
-                    cost_matrix[ci, pi] = dist
+    def link_frames(transition):
+        """Rows (curr, prev) linked across one frame transition"""
+        prev_slice, curr_slice = transition
+        prev_idx = np.arange(prev_slice.start, prev_slice.stop)[has_centroid[prev_slice]]
+        curr_idx = np.arange(curr_slice.start, curr_slice.stop)[has_centroid[curr_slice]]
+        if len(curr_idx) == 0 or len(prev_idx) == 0:
+            return curr_idx[:0], prev_idx[:0]
 
-        # Hungarian algorithm for optimal assignment
-        if cost_matrix.shape[0] > 0 and cost_matrix.shape[1] > 0:
-            row_ind, col_ind = linear_sum_assignment(cost_matrix)
-
-            assigned_curr = set()
-            for ci, pi in zip(row_ind, col_ind):
-                if cost_matrix[ci, pi] < np.inf:
-                    # Link to existing track
-                    prev_cell = prev_cells[pi]
-                    curr_cell = curr_cells[ci]
-                    curr_cell.track_id = prev_cell.track_id
-                    assigned_curr.add(ci)
-
-                    # Compute motion features
-                    curr_cell.delta_x = curr_cell.centroid_col - prev_cell.centroid_col
-                    curr_cell.delta_y = curr_cell.centroid_row - prev_cell.centroid_row
-                    curr_cell.displacement = np.sqrt(
-                        curr_cell.delta_x ** 2 + curr_cell.delta_y ** 2
-                    )
-                    curr_cell.speed = curr_cell.displacement
-
-                    # Compute turning angle if previous cell had motion
-                    if prev_cell.delta_x is not None and prev_cell.delta_y is not None:
-                        prev_angle = np.arctan2(prev_cell.delta_y, prev_cell.delta_x)
-                        curr_angle = np.arctan2(curr_cell.delta_y, curr_cell.delta_x)
-                        curr_cell.turning = curr_angle - prev_angle
-
-            # Assign new track IDs to unassigned cells
-            for ci, curr_cell in enumerate(curr_cells):
-                if ci not in assigned_curr:
-                    curr_cell.track_id = next_track_id
-                    next_track_id += 1
+        # Only pairs within max_distance are candidates; costs are kept in float32,
+        # which is plenty for ranking pixel distances
+        rows, cols, dists = _pairs_within(xy[curr_idx], xy[prev_idx], max_distance)
 
-    db.session.commit()
+        # Hungarian algorithm for optimal assignment
+        row_ind, col_ind = _solve_assignment(rows, cols, dists, (len(curr_idx), len(prev_idx)))
+        return curr_idx[row_ind], prev_idx[col_ind]
+
+    # Track through subsequent frames: the matching of each transition only depends
+    # on the two frames' centroids, so transitions are matched in a thread pool (the
+    # KD-tree and assignment solvers release the GIL) while the links are applied
+    # in frame order as they come in; deltas start from the stored values so
+    # turning angles can build on motion from an earlier run
+    transitions = list(zip(frame_slices, frame_slices[1:]))
+    with ThreadPoolExecutor(max_workers=TRACKING_WORKERS) as executor:
+        track_ids, linked, displacement, turning, unique_tracks = _link_tracks(
+            frame_slices, xy, deltas, executor.map(link_frames, transitions)
+        )
 
-    # Count tracks
-    unique_tracks = db.session.query(CellFeature.track_id).distinct().count()
+    _save_tracks(ids, track_ids, linked, deltas, displacement, turning)
 
     print(f"Tracking completed!")
     print(f"Total tracks: {unique_tracks}")
@@ -265,7 +561,7 @@ def run_tracking(max_distance=100.0):
     }
 
 
-def run_tracking_from_mask_labels():
+def run_tracking_from_mask_labels(extracted=None):
     """
     Use mask label values directly as track IDs.
 
@@ -273,95 +569,91 @@ def run_tracking_from_mask_labels():
     the same cell across frames has the same label value in the mask.
     This function uses cell_id (which comes from mask labels) as track_id.
 
+    Args:
+        extracted: Feature dicts from an extraction the caller has just run, used
+                   instead of reading them back from the database
+
     Returns:
         dict with tracking results
     """
     print("="*50, flush=True)
     print("MASK LABEL TRACKING: Using mask labels as track IDs...", flush=True)
 
-    # Get all features ordered by frame
-    features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
-    print(f"Found {len(features)} existing features in database", flush=True)
-
+    # Get the columns needed for linking, ordered by frame (plain rows, no ORM objects)
+    stmt = select(
+        CellFeature.id, CellFeature.frame_num, CellFeature.cell_id, CellFeature.centroid_row,
+        CellFeature.centroid_col, CellFeature.delta_x, CellFeature.delta_y
+    ).order_by(CellFeature.frame_num, CellFeature.cell_id)
     # Auto extract features if not available
+    features = _load_features_or_extract(stmt, extracted)
     if not features:
-        print("No features found, auto-extracting features from masks...", flush=True)
-        from app.services.feature_extraction_services import extract_features_batch
-        extract_result = extract_features_batch()
-        print(f"Auto-extract completed: {extract_result}", flush=True)
-
-        # Re-query features after extraction
-        features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
-        print(f"After extraction: {len(features)} features", flush=True)
-
-        if not features:
-            print("ERROR: No features found after extraction!", flush=True)
-            return {"error": "No features found. Make sure masks are available."}
+        print("ERROR: No features found after extraction!", flush=True)
+        return {"error": "No features found. Make sure masks are available."}
+
+    # Pull the columns into arrays once (NULLs become NaN); rows are sorted by
+    # frame, then cell_id
+    num_features = len(features)
+    columns = _feature_arrays(features)
+    ids = columns['id']
+    frame_col = columns['frame_num']
+    cell_col = columns['cell_id']
+    xy = np.column_stack((columns['centroid_row'], columns['centroid_col']))
+    deltas = np.column_stack((columns['delta_x'], columns['delta_y']))
 
     # Check if mask labels are consistent (same cell_id appears in multiple frames)
     # This indicates Cell Tracking Challenge format where label = track ID
-    from collections import defaultdict
-    cell_id_frames = defaultdict(list)
-    for f in features:
-        cell_id_frames[f.cell_id].append(f.frame_num)
-
-    # Check how many cell_ids appear in multiple frames
-    multi_frame_ids = [cid for cid, frames in cell_id_frames.items() if len(frames) > 1]
-    single_frame_ids = [cid for cid, frames in cell_id_frames.items() if len(frames) == 1]
+    occurrences = _value_counts(cell_col)
+    num_multi_frame_ids = int(np.count_nonzero(occurrences > 1))
+    num_single_frame_ids = len(occurrences) - num_multi_frame_ids
 
-    print(f"Cell IDs appearing in multiple frames: {len(multi_frame_ids)}", flush=True)
-    print(f"Cell IDs appearing in single frame: {len(single_frame_ids)}", flush=True)
+    print(f"Cell IDs appearing in multiple frames: {num_multi_frame_ids}", flush=True)
+    print(f"Cell IDs appearing in single frame: {num_single_frame_ids}", flush=True)
 
     # If most cells appear in multiple frames, use cell_id as track_id
-    if len(multi_frame_ids) > 0:
+    if num_multi_frame_ids > 0:
         print("Detected consistent cell IDs across frames - using as track IDs", flush=True)
 
-        # Group by frame for motion computation
-        frames = {}
-        for f in features:
-            if f.frame_num not in frames:
-                frames[f.frame_num] = {}
-            frames[f.frame_num][f.cell_id] = f
-
-        frame_nums = sorted(frames.keys())
+        # Position of each row's frame in the sorted frame list
+        frame_nums, frame_idx = np.unique(frame_col, return_inverse=True)
+        frame_nums = frame_nums.tolist()
         print(f"Frame range: {frame_nums[0]} to {frame_nums[-1]}", flush=True)
 
-        # Assign cell_id as track_id
-        for f in features:
-            f.track_id = f.cell_id
-
-        # Compute motion features by linking same cell_id across consecutive frames
-        for i in range(1, len(frame_nums)):
-            prev_frame = frame_nums[i - 1]
-            curr_frame = frame_nums[i]
-
-            prev_cells = frames[prev_frame]
-            curr_cells = frames[curr_frame]
-
-            # Find cells with same cell_id (track_id) in both frames
-            for cell_id, curr_cell in curr_cells.items():
-                if cell_id in prev_cells:
-                    prev_cell = prev_cells[cell_id]
-
-                    # Compute motion features
-                    if curr_cell.centroid_col is not None and prev_cell.centroid_col is not None:
-                        curr_cell.delta_x = curr_cell.centroid_col - prev_cell.centroid_col
-                        curr_cell.delta_y = curr_cell.centroid_row - prev_cell.centroid_row
-                        curr_cell.displacement = np.sqrt(
-                            curr_cell.delta_x ** 2 + curr_cell.delta_y ** 2
-                        )
-                        curr_cell.speed = curr_cell.displacement
-
-                        # Compute turning angle if previous cell had motion
-                        if prev_cell.delta_x is not None and prev_cell.delta_y is not None:
-                            prev_angle = np.arctan2(prev_cell.delta_y, prev_cell.delta_x)
-                            curr_angle = np.arctan2(curr_cell.delta_y, curr_cell.delta_x)
-                            curr_cell.turning = curr_angle - prev_angle
-
-        db.session.commit()
-
-        # Count unique tracks
-        unique_tracks = db.session.query(CellFeature.track_id).distinct().count()
+        # Assign cell_id as track_id - one UPDATE for every row, so only the
+        # motion columns are left for the per-row updates
+        db.session.execute(update(CellFeature).values(track_id=CellFeature.cell_id))
+        linked = np.zeros(num_features, dtype=bool)
+        displacement = np.full(num_features, np.nan)
+        turning = np.full(num_features, np.nan)
+
+        # One row per (frame, cell_id) - the last one, if a label repeats. Rows are
+        # sorted by frame then cell_id, so their (frame, cell_id) keys are sorted too
+        rows = np.flatnonzero(np.r_[(frame_col[1:] != frame_col[:-1]) | (cell_col[1:] != cell_col[:-1]), True])
+        stride = int(cell_col.max() - cell_col.min()) + 1
+        keys = frame_idx[rows] * stride + (cell_col[rows] - cell_col.min())
+
+        # Link every row to the same cell_id in the previous frame in one lookup
+        prev_keys = keys - stride
+        pos = np.minimum(np.searchsorted(keys, prev_keys), len(keys) - 1)
+        found = keys[pos] == prev_keys
+        ci = rows[found]
+        pi = rows[pos[found]]
+
+        # Compute motion features where both cells have a centroid
+        has_centroids = ~(np.isnan(xy[ci]).any(axis=1) | np.isnan(xy[pi]).any(axis=1))
+        ci = ci[has_centroids]
+        pi = pi[has_centroids]
+        linked[ci] = True
+
+        # All frames are linked at once, so the deltas from this run are stored first:
+        # turning needs the previous cell's motion, from this run where it was linked
+        # and stored otherwise (NaN where it had none)
+        deltas[ci] = xy[ci, ::-1] - xy[pi, ::-1]
+        _, _, displacement[ci], turning[ci] = _compute_motion(xy[ci], xy[pi], deltas[pi])
+
+        _save_tracks(ids, None, linked, deltas, displacement, turning)
+
+        # Track IDs are the cell IDs, so there is one track per distinct cell ID
+        unique_tracks = len(occurrences)
 
         print(f"Mask label tracking completed!", flush=True)
         print(f"Total tracks: {unique_tracks}", flush=True)
@@ -403,16 +695,17 @@ def run_gnn_tracking(dataset_name=None):
     if dataset_name:
         print(f"Dataset name provided: {dataset_name}", flush=True)
 
-    # First, auto-extract features if not available
-    features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
-    if not features:
+    # First, auto-extract features if not available (only existence matters here);
+    # the mask label fallback reuses the extracted features instead of re-reading them
+    extracted = None
+    if db.session.execute(select(CellFeature.id).limit(1)).first() is None:
         print("No features found, auto-extracting features from masks...", flush=True)
         from app.services.feature_extraction_services import extract_features_batch
-        extract_result = extract_features_batch()
+        extract_result = extract_features_batch(return_features=True)
+        extracted = extract_result.pop("features")
         print(f"Auto-extract completed: {extract_result}", flush=True)
-        features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
 
-        if not features:
+        if not extracted:
             return {"error": "No features found. Make sure masks are available."}
 
     # Check if GNN is available
@@ -420,7 +713,7 @@ def run_gnn_tracking(dataset_name=None):
         print("GNN dependencies not available", flush=True)
         print("Checking if masks contain embedded track IDs...", flush=True)
         print("="*50, flush=True)
-        return run_tracking_from_mask_labels()
+        return run_tracking_from_mask_labels(extracted)
 
     # Try to find pretrained models for the given dataset name first
     metric_model_path = None
@@ -449,7 +742,7 @@ def run_gnn_tracking(dataset_name=None):
         print("Please train models using cell-tracker-gnn or copy pretrained models")
         print("Checking if masks contain embedded track IDs...")
         print("="*50)
-        return run_tracking_from_mask_labels()
+        return run_tracking_from_mask_labels(extracted)
 
     try:
         result = _run_gnn_tracking_internal(metric_model_path, tracking_model_path)
@@ -462,7 +755,26 @@ def run_gnn_tracking(dataset_name=None):
         print(f"GNN tracking failed with error: {e}")
         print("Checking if masks contain embedded track IDs...")
         print("="*50)
-        return run_tracking_from_mask_labels()
+        return run_tracking_from_mask_labels(extracted)
+
+
+def _stage(src, dst):
+    """
+    Make src available as dst for the GNN pipeline without copying when possible:
+    hardlink (same filesystem), then symlink, then a plain copy as last resort.
+    Removing the staging directory afterwards never touches the originals.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return
+    except OSError:
+        pass
+    shutil.copy(src, dst)
 
 
 def _run_gnn_tracking_internal(metric_model_path, tracking_model_path):
@@ -502,45 +814,55 @@ def _run_gnn_tracking_internal(metric_model_path, tracking_model_path):
         os.makedirs(seg_dir, exist_ok=True)
         os.makedirs(csv_dir, exist_ok=True)
 
-        # Copy/link images and masks with proper naming
-        for i, img in enumerate(images):
-            if img.filepath and os.path.exists(img.filepath):
+        # Copy/link images and masks with proper naming; the filesystem calls
+        # release the GIL, so a few threads stage files concurrently
+        def stage_one(item):
+            i, filepath, mask_filepath = item
+            if filepath and os.path.exists(filepath):
                 # Copy with standardized naming (t000.tif, t001.tif, etc.)
-                ext = os.path.splitext(img.filepath)[1]
+                ext = os.path.splitext(filepath)[1]
                 dst_name = f"t{i:03d}{ext}"
-                shutil.copy(img.filepath, os.path.join(img_dir, dst_name))
+                _stage(filepath, os.path.join(img_dir, dst_name))
 
-            if img.mask_filepath and os.path.exists(img.mask_filepath):
-                ext = os.path.splitext(img.mask_filepath)[1]
+            if mask_filepath and os.path.exists(mask_filepath):
+                ext = os.path.splitext(mask_filepath)[1]
                 dst_name = f"man_seg{i:03d}{ext}"
-                shutil.copy(img.mask_filepath, os.path.join(seg_dir, dst_name))
-
-        # Step 1: Feature extraction using metric learning
-        # Note: inference_clean.py expects folder structure: {csv_dir}/01_CSV/csv/
-        # So we create csv output in {csv_dir}/01_CSV/
-        print("Step 1: Extracting features using metric learning model...")
-        from src.inference.preprocess_seq2graph_clean import create_csv
-
-        # Create the expected folder structure for inference
-        seq_csv_dir = os.path.join(csv_dir, '01_CSV')
-        os.makedirs(seq_csv_dir, exist_ok=True)
-
-        create_csv(
-            input_images=img_dir,
-            input_seg=seg_dir,
-            input_model=metric_model_path,
-            output_csv=seq_csv_dir,  # This will create 01_CSV/csv/ folder
-            min_cell_size=20
-        )
-
-        # Step 2: Run GNN inference
-        print("Step 2: Running GNN inference...")
-        from src.inference.inference_clean import predict
-        predict(
-            ckpt_path=tracking_model_path,
-            path_csv_output=csv_dir,  # inference will look for {csv_dir}/01_CSV/csv/
-            num_seq='01'
-        )
+                _stage(mask_filepath, os.path.join(seg_dir, dst_name))
+
+        # Paths are read here so worker threads never touch the ORM session
+        staging = [(i, img.filepath, img.mask_filepath) for i, img in enumerate(images)]
+        with ThreadPoolExecutor(max_workers=STAGING_WORKERS) as executor:
+            list(executor.map(stage_one, staging))
+
+        # Both steps only run forward passes of the pretrained models, so autograd
+        # bookkeeping is switched off for them
+        with torch.inference_mode():
+            # Step 1: Feature extraction using metric learning
+            # Note: inference_clean.py expects folder structure: {csv_dir}/01_CSV/csv/
+            # So we create csv output in {csv_dir}/01_CSV/
+            print("Step 1: Extracting features using metric learning model...")
+            from src.inference.preprocess_seq2graph_clean import create_csv
+
+            # Create the expected folder structure for inference
+            seq_csv_dir = os.path.join(csv_dir, '01_CSV')
+            os.makedirs(seq_csv_dir, exist_ok=True)
+
+            create_csv(
+                input_images=img_dir,
+                input_seg=seg_dir,
+                input_model=metric_model_path,
+                output_csv=seq_csv_dir,  # This will create 01_CSV/csv/ folder
+                min_cell_size=20
+            )
+
+            # Step 2: Run GNN inference
+            print("Step 2: Running GNN inference...")
+            from src.inference.inference_clean import predict
+            predict(
+                ckpt_path=tracking_model_path,
+                path_csv_output=csv_dir,  # inference will look for {csv_dir}/01_CSV/csv/
+                num_seq='01'
+            )
 
         # Step 3: Postprocess and update database
         print("Step 3: Processing tracking results...")
@@ -557,6 +879,20 @@ def _run_gnn_tracking_internal(metric_model_path, tracking_model_path):
             print(f"Warning: Failed to cleanup temp dir: {e}")
 
 
+def _load_torch_file(path):
+    """
+    torch.load onto the CPU, memory-mapping the file's tensor storage instead of
+    reading it all into memory first (legacy non-zip files, and torch < 2.1 without
+    the mmap keyword, are loaded normally)
+    """
+    import torch
+
+    try:
+        return torch.load(path, map_location='cpu', weights_only=False, mmap=True)
+    except (RuntimeError, TypeError):
+        return torch.load(path, map_location='cpu', weights_only=False)
+
+
 def _process_gnn_results(csv_dir):
     """
     Process GNN inference results and update database with track assignments.
@@ -574,13 +910,12 @@ def _process_gnn_results(csv_dir):
     import pandas as pd
 
     # Look for result files
-    result_dir = None
-    for d in os.listdir(csv_dir):
-        if d.endswith('_RES_inference'):
-            result_dir = os.path.join(csv_dir, d)
-            break
+    with os.scandir(csv_dir) as entries:
+        result_dir = next(
+            (entry.path for entry in entries if entry.name.endswith('_RES_inference') and entry.is_dir()), None
+        )
 
-    if not result_dir or not os.path.exists(result_dir):
+    if not result_dir:
         print("GNN results directory not found")
         return run_tracking_from_mask_labels()  # Fallback to mask labels
 
@@ -589,149 +924,142 @@ def _process_gnn_results(csv_dir):
     graph_path = os.path.join(result_dir, 'pytorch_geometric_data.pt')
     output_path = os.path.join(result_dir, 'raw_output.pt')
 
-    if not os.path.exists(df_path) or not os.path.exists(graph_path) or not os.path.exists(output_path):
-        print("GNN results files not found")
-        print(f"  df_path exists: {os.path.exists(df_path)}")
-        print(f"  graph_path exists: {os.path.exists(graph_path)}")
-        print(f"  output_path exists: {os.path.exists(output_path)}")
+    # One directory listing instead of a stat per expected file
+    with os.scandir(result_dir) as entries:
+        present = {entry.name for entry in entries if entry.is_file()}
+    missing = sorted({'all_data_df.csv', 'pytorch_geometric_data.pt', 'raw_output.pt'} - present)
+    if missing:
+        print(f"GNN results files not found: {missing}")
         return run_tracking_from_mask_labels()  # Fallback to mask labels
 
     # Load GNN outputs
-    df = pd.read_csv(df_path)
-    graph_data = torch.load(graph_path, weights_only=False)
-    raw_output = torch.load(output_path, weights_only=False)
+    df = pd.read_csv(df_path, usecols=lambda c: c in GNN_DF_COLUMNS)
+    graph_data = _load_torch_file(graph_path)
+    raw_output = _load_torch_file(output_path)
 
     print(f"Loaded GNN results:")
     print(f"  DataFrame: {len(df)} cells")
     print(f"  Edge index shape: {graph_data.edge_index.shape}")
     print(f"  Raw output shape: {raw_output.shape}")
 
-    # Get edge predictions (apply sigmoid to get probabilities)
-    edge_probs = torch.sigmoid(raw_output).squeeze().detach().cpu().numpy()
-    edge_index = graph_data.edge_index.cpu().numpy()
+    # Get edge predictions (apply sigmoid to get probabilities); they stay on the
+    # device the model produced them on until the edges are filtered
+    edge_probs = torch.sigmoid(raw_output.detach().reshape(-1))
+    edge_index = graph_data.edge_index.to(edge_probs.device)
 
-    print(f"  Edge probabilities range: [{edge_probs.min():.4f}, {edge_probs.max():.4f}]")
+    print(f"  Edge probabilities range: [{edge_probs.min().item():.4f}, {edge_probs.max().item():.4f}]")
 
-    # Build mapping from df index to (frame_num, seg_label)
+    # Map df index to (frame_num, seg_label)
     # The df contains: frame_num, id (track id from GT), seg_label (cell label in mask), features...
-    df_frame_nums = df['frame_num'].values
-    df_seg_labels = df['seg_label'].values if 'seg_label' in df.columns else df['id'].values
+    df_frame_nums = df['frame_num'].to_numpy()
+    # Rows with an empty label are kept (edge_index refers to row positions) but
+    # never linked; their placeholder label -1 is never read
+    labels = pd.to_numeric(df['seg_label'] if 'seg_label' in df.columns else df['id'], errors='coerce')
+    df_has_label = labels.notna().to_numpy()
+    df_seg_labels = labels.fillna(-1).to_numpy().astype(np.int64)
 
     # Get unique frames
-    unique_frames = sorted(df['frame_num'].unique())
+    unique_frames = np.unique(df_frame_nums).tolist()
     print(f"  Frames: {unique_frames}")
 
-    # Build cell index mapping: df_index -> (frame_num, seg_label)
-    cell_info = []
-    for idx in range(len(df)):
-        cell_info.append({
-            'df_idx': idx,
-            'frame_num': df_frame_nums[idx],
-            'seg_label': df_seg_labels[idx]
-        })
-
     # Extract edges between consecutive frames with high probability
     # edge_index[0] = source nodes, edge_index[1] = target nodes
     THRESHOLD = 0.5  # Probability threshold for edge acceptance
 
-    # Build adjacency list for high-confidence edges between consecutive frames
-    edges_by_frame = {}  # frame -> list of (src_seg_label, tgt_seg_label, prob)
-
-    for edge_idx in range(edge_index.shape[1]):
-        src_idx = edge_index[0, edge_idx]
-        tgt_idx = edge_index[1, edge_idx]
-        prob = edge_probs[edge_idx]
-
-        src_frame = cell_info[src_idx]['frame_num']
-        tgt_frame = cell_info[tgt_idx]['frame_num']
-
-        # Only consider edges between consecutive frames (src -> tgt, src is earlier)
-        if tgt_frame == src_frame + 1 and prob >= THRESHOLD:
-            src_seg = cell_info[src_idx]['seg_label']
-            tgt_seg = cell_info[tgt_idx]['seg_label']
-
-            if src_frame not in edges_by_frame:
-                edges_by_frame[src_frame] = []
-            edges_by_frame[src_frame].append((src_seg, tgt_seg, prob))
-
-    print(f"  High-confidence edges by frame: {[(f, len(e)) for f, e in edges_by_frame.items()]}")
+    # Only consider edges between consecutive frames (src -> tgt, src is earlier);
+    # filtering happens on the tensors, so only the surviving edges are copied to the CPU
+    # (torch.tensor copies: pandas may hand back a read-only array, which as_tensor warns about)
+    frame_t = torch.tensor(df_frame_nums, dtype=torch.int64, device=edge_probs.device)
+    has_label_t = torch.tensor(df_has_label, device=edge_probs.device)
+    keep = (frame_t[edge_index[1]] == frame_t[edge_index[0]] + 1) & (edge_probs >= THRESHOLD)
+    keep &= has_label_t[edge_index[0]] & has_label_t[edge_index[1]]
+    kept_index = edge_index[:, keep]
+
+    # Order the edges by probability (highest first), then group them by source
+    # frame; both sorts are stable, so equally likely edges keep their original order
+    kept_index = kept_index[:, torch.sort(edge_probs[keep], descending=True, stable=True).indices]
+    kept_index = kept_index[:, torch.sort(frame_t[kept_index[0]], stable=True).indices].cpu().numpy()
+
+    # High-confidence edges as parallel arrays, in the order above
+    edge_src_frame = df_frame_nums[kept_index[0]]
+    edge_src_seg = df_seg_labels[kept_index[0]]
+    edge_tgt_seg = df_seg_labels[kept_index[1]]
+
+    # frame -> (src_seg_labels, tgt_seg_labels) views of its edges, split where the
+    # (sorted) source frame changes
+    splits = np.flatnonzero(np.diff(edge_src_frame)) + 1
+    edges_by_frame = dict(zip(
+        edge_src_frame[np.r_[0, splits]].tolist() if len(edge_src_frame) else [],
+        zip(np.split(edge_src_seg, splits), np.split(edge_tgt_seg, splits))
+    ))
+
+    no_edges = np.empty(0, dtype=np.int64)
+
+    print(f"  High-confidence edges by frame: {[(f, len(src)) for f, (src, _) in edges_by_frame.items()]}")
 
     # Now update database with track assignments using GNN predictions
-    features = CellFeature.query.order_by(CellFeature.frame_num, CellFeature.cell_id).all()
+    # (plain rows for the columns needed, pulled into per-column arrays once)
+    features = db.session.execute(select(
+        CellFeature.id, CellFeature.frame_num, CellFeature.cell_id, CellFeature.centroid_row,
+        CellFeature.centroid_col, CellFeature.delta_x, CellFeature.delta_y
+    ).order_by(CellFeature.frame_num, CellFeature.cell_id)).all()
 
     if not features:
         return {"error": "No features found in database"}
 
-    # Group features by frame
-    frames = {}
-    for f in features:
-        if f.frame_num not in frames:
-            frames[f.frame_num] = {}
-        frames[f.frame_num][f.cell_id] = f  # cell_id is the seg_label
-
-    frame_nums = sorted(frames.keys())
-    next_track_id = 1
-
-    # First frame - assign new track IDs
-    for cell_id, cell in frames[frame_nums[0]].items():
-        cell.track_id = next_track_id
-        next_track_id += 1
-
-    # Process subsequent frames using GNN predictions
-    for i in range(1, len(frame_nums)):
-        prev_frame = frame_nums[i - 1]
-        curr_frame = frame_nums[i]
-
-        prev_cells = frames[prev_frame]
-        curr_cells = frames[curr_frame]
-
-        # Get GNN predicted edges for this frame transition
-        gnn_edges = edges_by_frame.get(prev_frame, [])
-
-        # Sort edges by probability (highest first)
-        gnn_edges.sort(key=lambda x: x[2], reverse=True)
-
-        # Track which cells have been assigned
-        assigned_prev = set()
-        assigned_curr = set()
-
-        # Use GNN predictions to link cells
-        for src_seg, tgt_seg, prob in gnn_edges:
-            # Check if both cells exist and are not yet assigned
-            if src_seg in prev_cells and tgt_seg in curr_cells:
-                if src_seg not in assigned_prev and tgt_seg not in assigned_curr:
-                    prev_cell = prev_cells[src_seg]
-                    curr_cell = curr_cells[tgt_seg]
-
-                    # Assign same track ID
-                    curr_cell.track_id = prev_cell.track_id
-                    assigned_prev.add(src_seg)
-                    assigned_curr.add(tgt_seg)
-
-                    # Compute motion features
-                    if curr_cell.centroid_col is not None and prev_cell.centroid_col is not None:
-                        curr_cell.delta_x = curr_cell.centroid_col - prev_cell.centroid_col
-                        curr_cell.delta_y = curr_cell.centroid_row - prev_cell.centroid_row
-                        curr_cell.displacement = np.sqrt(
-                            curr_cell.delta_x ** 2 + curr_cell.delta_y ** 2
-                        )
-                        curr_cell.speed = curr_cell.displacement
-
-                        # Compute turning angle if previous cell had motion
-                        if prev_cell.delta_x is not None and prev_cell.delta_y is not None:
-                            prev_angle = np.arctan2(prev_cell.delta_y, prev_cell.delta_x)
-                            curr_angle = np.arctan2(curr_cell.delta_y, curr_cell.delta_x)
-                            curr_cell.turning = curr_angle - prev_angle
-
-        # Assign new track IDs to unassigned cells in current frame
-        for cell_id, curr_cell in curr_cells.items():
-            if cell_id not in assigned_curr:
-                curr_cell.track_id = next_track_id
-                next_track_id += 1
-
-    db.session.commit()
+    # The GNN refers to cells by (frame, seg label); seg label is the cell_id, and
+    # only the last row of a repeated (frame, cell_id) is tracked
+    columns = _feature_arrays(features)
+    frame_col = columns['frame_num']
+    cell_col = columns['cell_id']
+    rows = np.flatnonzero(np.r_[(frame_col[1:] != frame_col[:-1]) | (cell_col[1:] != cell_col[:-1]), True])
+    frame_col = frame_col[rows]
+    cell_col = cell_col[rows]
+    ids = columns['id'][rows]
+    xy = np.column_stack((columns['centroid_row'], columns['centroid_col']))[rows]
+    deltas = np.column_stack((columns['delta_x'], columns['delta_y']))[rows]
+    frame_slices, frame_nums = _frame_slices(frame_col)
+
+    def gnn_links():
+        """Rows (curr, prev) linked by each transition's GNN edges, greedily in edge order"""
+        # matched_prev/matched_curr flag rows already used as an edge's source/target
+        matched_prev = bytearray(len(rows))
+        matched_curr = bytearray(len(rows))
+
+        # Seg label -> row of the current/previous frame (-1 where the label is absent)
+        label_span = int(cell_col.max()) + 1
+        prev_rows = np.full(label_span, -1, dtype=np.int64)
+        curr_rows = np.full(label_span, -1, dtype=np.int64)
+        first = frame_slices[0]
+        curr_rows[cell_col[first]] = np.arange(first.start, first.stop)
 
-    unique_tracks = db.session.query(CellFeature.track_id).distinct().count()
+        for i in range(1, len(frame_nums)):
+            curr_slice = frame_slices[i]
+            prev_rows, curr_rows = curr_rows, prev_rows
+            curr_rows.fill(-1)
+            curr_rows[cell_col[curr_slice]] = np.arange(curr_slice.start, curr_slice.stop)
+
+            # Get GNN predicted edges for this frame transition (highest probability first)
+            # as rows; edges to labels that aren't in the database are dropped
+            src_segs, tgt_segs = edges_by_frame.get(frame_nums[i - 1], (no_edges, no_edges))
+            known = (src_segs >= 0) & (src_segs < label_span) & (tgt_segs >= 0) & (tgt_segs < label_span)
+            src_rows = prev_rows[src_segs[known]]
+            tgt_rows = curr_rows[tgt_segs[known]]
+            known = (src_rows >= 0) & (tgt_rows >= 0)
+
+            # Use GNN predictions to link cells, greedily in edge order
+            pairs = []
+            for src_row, tgt_row in zip(src_rows[known].tolist(), tgt_rows[known].tolist()):
+                if not matched_prev[src_row] and not matched_curr[tgt_row]:
+                    matched_prev[src_row] = 1
+                    matched_curr[tgt_row] = 1
+                    pairs.append((tgt_row, src_row))
+            yield np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+
+    # Linked cells share the track ID even without centroids; motion is only
+    # computed where both have one
+    track_ids, linked, displacement, turning, unique_tracks = _link_tracks(frame_slices, xy, deltas, gnn_links())
+    _save_tracks(ids, track_ids, linked, deltas, displacement, turning)
 
     print(f"GNN Tracking completed!")
     print(f"Total tracks: {unique_tracks}")
@@ -749,8 +1077,11 @@ def _process_gnn_results(csv_dir):
 
 def get_track_data(track_id):
     """Get all cells belonging to a specific track"""
-    cells = CellFeature.query.filter_by(track_id=track_id).order_by(CellFeature.frame_num).all()
-    return [c.to_dict() for c in cells]
+    # Plain column rows carry the same fields as CellFeature.to_dict()
+    stmt = select(*CellFeature.__table__.columns).where(
+        CellFeature.track_id == track_id
+    ).order_by(CellFeature.frame_num)
+    return [dict(row) for row in db.session.execute(stmt).mappings()]
 
 
 def get_all_tracks():
@@ -758,39 +1089,59 @@ def get_all_tracks():
     # Get unique track IDs with their cell counts and frame ranges
     from sqlalchemy import func
 
-    tracks = db.session.query(
+    start_frame = func.min(CellFeature.frame_num)
+    end_frame = func.max(CellFeature.frame_num)
+    stmt = select(
         CellFeature.track_id,
         func.count(CellFeature.id).label('cell_count'),
-        func.min(CellFeature.frame_num).label('start_frame'),
-        func.max(CellFeature.frame_num).label('end_frame')
-    ).filter(
+        start_frame.label('start_frame'),
+        end_frame.label('end_frame'),
+        (end_frame - start_frame + 1).label('duration')
+    ).where(
         CellFeature.track_id.isnot(None)
     ).group_by(
         CellFeature.track_id
-    ).all()
-
-    return [
-        {
-            "track_id": t.track_id,
-            "cell_count": t.cell_count,
-            "start_frame": t.start_frame,
-            "end_frame": t.end_frame,
-            "duration": t.end_frame - t.start_frame + 1
-        }
-        for t in tracks
-    ]
+    )
+
+    return [row._asdict() for row in db.session.execute(stmt)]
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Pause cyclic garbage collection for an allocation burst.
+
+    Building many rows/dicts in a row triggers repeated GC passes that find nothing
+    to free. Collection is restored afterwards only if it was enabled before, so
+    nested use is safe. Never hold this across a yield.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
 
 
 def export_tracks_to_csv():
-    """Export tracking results to CSV"""
-    features = CellFeature.query.filter(
+    """
+    Export tracking results to CSV
+
+    Generator yielding the header line and then the tracked cells in chunks of about
+    CSV_CHUNK_SIZE characters, so the caller can stream the response instead of
+    building the whole file in memory.
+    """
+    stmt = select(
+        CellFeature.track_id, CellFeature.frame_num, CellFeature.cell_id, CellFeature.image_id,
+        CellFeature.centroid_row, CellFeature.centroid_col, CellFeature.area,
+        CellFeature.delta_x, CellFeature.delta_y, CellFeature.displacement, CellFeature.speed, CellFeature.turning,
+        CellFeature.gmm_state, CellFeature.hmm_state
+    ).where(
         CellFeature.track_id.isnot(None)
     ).order_by(
         CellFeature.track_id, CellFeature.frame_num
-    ).all()
-
-    output = StringIO()
-    writer = csv.writer(output)
+    ).execution_options(yield_per=10_000)
 
     header = [
         'track_id', 'frame_num', 'cell_id', 'image_id',
@@ -798,18 +1149,31 @@ def export_tracks_to_csv():
         'delta_x', 'delta_y', 'displacement', 'speed', 'turning',
         'gmm_state', 'hmm_state'
     ]
-    writer.writerow(header)
-
-    for f in features:
-        row = [
-            f.track_id, f.frame_num, f.cell_id, f.image_id,
-            f.centroid_row, f.centroid_col, f.area,
-            f.delta_x, f.delta_y, f.displacement, f.speed, f.turning,
-            f.gmm_state, f.hmm_state
-        ]
-        writer.writerow(row)
-
-    return output.getvalue()
+    # Run the query before the header is yielded, so a failing query surfaces on the
+    # first chunk rather than partway through the streamed response
+    result = db.session.execute(stmt)
+    yield ','.join(header) + '\r\n'
+
+    # All exported columns are numeric, so no quoting is needed; NULLs become empty fields
+    line_fmt = ','.join(['%s'] * len(header)) + '\r\n'
+    chunk = []
+    chunk_size = 0
+    for partition in result.partitions():
+        with _gc_paused():
+            lines = [
+                line_fmt % tuple('' if value is None else value for value in row) if None in row
+                else line_fmt % tuple(row)
+                for row in partition
+            ]
+        for line in lines:
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= CSV_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                chunk_size = 0
+    if chunk:
+        yield ''.join(chunk)
 
 
 def export_for_cell_tracker_gnn(output_dir=None):
@@ -822,45 +1186,57 @@ def export_for_cell_tracker_gnn(output_dir=None):
     Returns:
         dict with export info
     """
-    import json
-    import tempfile
-
     if output_dir is None:
         output_dir = tempfile.mkdtemp(prefix='cell_tracker_')
 
     os.makedirs(output_dir, exist_ok=True)
 
-    # Get all features grouped by frame
-    features = CellFeature.query.order_by(CellFeature.frame_num).all()
-
-    frames_data = {}
-    for f in features:
-        frame_num = f.frame_num
-        if frame_num not in frames_data:
-            frames_data[frame_num] = []
-
-        frames_data[frame_num].append({
-            'cell_id': f.cell_id,
-            'centroid': [f.centroid_row, f.centroid_col],
-            'bbox': [f.min_row_bb, f.min_col_bb, f.max_row_bb, f.max_col_bb],
-            'area': f.area,
-            'features': {
-                'major_axis_length': f.major_axis_length,
-                'minor_axis_length': f.minor_axis_length,
-                'eccentricity': f.eccentricity,
-                'solidity': f.solidity,
-                'mean_intensity': f.mean_intensity
-            }
-        })
-
-    # Save as JSON files per frame
-    for frame_num, cells in frames_data.items():
-        frame_file = os.path.join(output_dir, f'frame_{frame_num:04d}.json')
-        with open(frame_file, 'w') as f:
-            json.dump(cells, f, indent=2)
+    # Stream the features frame by frame; each frame is handed to the writer pool
+    # as soon as it is complete, so only the frames still being written are in memory
+    stmt = select(
+        CellFeature.frame_num, CellFeature.cell_id, CellFeature.centroid_row, CellFeature.centroid_col,
+        CellFeature.min_row_bb, CellFeature.min_col_bb, CellFeature.max_row_bb, CellFeature.max_col_bb,
+        CellFeature.area, CellFeature.major_axis_length, CellFeature.minor_axis_length,
+        CellFeature.eccentricity, CellFeature.solidity, CellFeature.mean_intensity
+    ).order_by(CellFeature.frame_num, CellFeature.id).execution_options(yield_per=10_000)
+
+    # Save as compact JSON files per frame; writes overlap in a thread pool, which
+    # starts threads only as frames are submitted (serialising in worker processes
+    # would cost as much pickling the cells over as it saves)
+    max_workers = min(32, (os.cpu_count() or 4) * 4)
+    futures = []
+    total_cells = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for frame_num, rows in groupby(db.session.execute(stmt), key=attrgetter('frame_num')):
+            with _gc_paused():
+                cells = [{
+                    'cell_id': f.cell_id,
+                    'centroid': [f.centroid_row, f.centroid_col],
+                    'bbox': [f.min_row_bb, f.min_col_bb, f.max_row_bb, f.max_col_bb],
+                    'area': f.area,
+                    'features': {
+                        'major_axis_length': f.major_axis_length,
+                        'minor_axis_length': f.minor_axis_length,
+                        'eccentricity': f.eccentricity,
+                        'solidity': f.solidity,
+                        'mean_intensity': f.mean_intensity
+                    }
+                } for f in rows]
+            total_cells += len(cells)
+            futures.append(executor.submit(
+                _write_frame_json, os.path.join(output_dir, f'frame_{frame_num:04d}.json'), cells
+            ))
+        for future in futures:
+            future.result()
 
     return {
         "output_dir": output_dir,
-        "frames_exported": len(frames_data),
-        "total_cells": len(features)
+        "frames_exported": len(futures),
+        "total_cells": total_cells
     }
+
+
+def _write_frame_json(path, cells):
+    """Write one frame's cells for export_for_cell_tracker_gnn"""
+    with open(path, 'w') as f:
+        json.dump(cells, f, separators=(',', ':'))
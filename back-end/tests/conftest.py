@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Tests run against an in-memory SQLite database
+os.environ["DATABASE_URL"] = "sqlite://"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import db
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,39 @@
+import pytest
+
+from app.extensions import db
+from app.models import Image as ImageModel, CellFeature
+from app.services.feature_extraction_services import bulk_insert_features
+
+
+def _rows(image_id, count):
+    return [
+        {"image_id": image_id, "cell_id": i + 1, "frame_num": 0, "area": float(i), "centroid_row": 1.5 * i}
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("ordered_returning", [True, False])
+def test_bulk_insert_features_returns_ids_in_row_order(app, monkeypatch, ordered_returning):
+    dialect = db.engine.dialect
+    if not ordered_returning:
+        # Dialect without INSERT..RETURNING, like SQLite before 3.35
+        monkeypatch.setattr(dialect, "insert_returning", False)
+        monkeypatch.setattr(dialect, "insert_executemany_returning", False)
+        monkeypatch.setattr(dialect, "insert_executemany_returning_sort_by_parameter_order", False)
+    elif not dialect.insert_executemany_returning_sort_by_parameter_order:
+        pytest.skip("SQLite build without RETURNING support")
+
+    image = ImageModel(filename="t000.tif")
+    db.session.add(image)
+    db.session.flush()
+
+    rows = _rows(image.id, 7)
+    ids = bulk_insert_features(rows, chunk_size=3)
+    db.session.commit()
+
+    assert len(ids) == len(rows) == len(set(ids))
+    stored = {feature.id: feature for feature in CellFeature.query.all()}
+    assert sorted(stored) == sorted(ids)
+    for feature_id, row in zip(ids, rows):
+        assert stored[feature_id].cell_id == row["cell_id"]
+        assert stored[feature_id].centroid_row == row["centroid_row"]
@@ -0,0 +1,16 @@
+import numpy as np
+import tifffile
+
+from app.services.segmentation_services import _load_image_array
+
+
+def test_load_image_array_moves_planar_tiff_channels_last(tmp_path):
+    path = tmp_path / "planar.tif"
+    data = np.arange(3 * 20 * 30, dtype=np.uint8).reshape(3, 20, 30)
+    tifffile.imwrite(path, data, planarconfig="separate", photometric="rgb")
+
+    img_array, full_shape = _load_image_array(str(path))
+
+    assert full_shape == (20, 30)
+    assert img_array.shape == (20, 30, 3)
+    np.testing.assert_array_equal(img_array, np.moveaxis(data, 0, -1))
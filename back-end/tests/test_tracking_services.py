@@ -0,0 +1,30 @@
+import pytest
+
+from app.services import tracking_services
+from app.services.tracking_services import PRETRAINED_DATASETS, clear_caches, get_pretrained_models_for_dataset
+
+
+@pytest.fixture
+def counted_exists(monkeypatch):
+    calls = []
+
+    def exists(path):
+        calls.append(path)
+        return True
+
+    clear_caches()
+    monkeypatch.setattr(tracking_services.os.path, "exists", exists)
+    yield calls
+    clear_caches()
+
+
+def test_repeated_model_lookup_skips_os_path_exists(counted_exists):
+    expected = (PRETRAINED_DATASETS["Fluo-N2DL-HeLa"]["metric_model"],
+                PRETRAINED_DATASETS["Fluo-N2DL-HeLa"]["tracking_model"])
+
+    assert get_pretrained_models_for_dataset("Fluo-N2DL-HeLa-01") == expected
+    first_calls = len(counted_exists)
+    assert first_calls == 2
+
+    assert get_pretrained_models_for_dataset("Fluo-N2DL-HeLa-02") == expected
+    assert len(counted_exists) == first_calls